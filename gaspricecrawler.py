@@ -1,126 +1,120 @@
 #!/usr/bin/env python3
 import requests
-import lxml
-from bs4 import BeautifulSoup
+from lxml import etree, html
 import csv
 import pandas as pd
-from urllib.request import urlopen as uReq
-import numpy as np
 import os
 from datetime import date
 import sys
-from termcolor import colored, cprint
+from concurrent.futures import ThreadPoolExecutor
 
 
 
-# Function to remove tags
-def remove_tags(html):
-  
-    # parse html content
-    soup = BeautifulSoup(html, "html.parser")
-  
-    for data in soup(['style', 'script']):
-        # Remove tags
-        data.decompose()
-  
-    # return data by retrieving the tag content
-    return ' '.join(soup.stripped_strings)
-
-
 # Function to retrieve data from 98 bensin
 url_98 = 'https://bensinpriser.nu/stationer/98/alla/alla'
 url_diesel = 'https://bensinpriser.nu/stationer/diesel/alla/alla'
+urls = [url_98, url_diesel]
+headers = {
+'User-Agent': 'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/63.0.3239.132 Safari/537.36 QIHU 360SE'
+}
+
+# One session for every request so the connection to bensinpriser.nu is kept alive
+session = requests.Session()
+session.headers.update(headers)
+session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=len(urls)))
+
+# XPath expressions compiled once and reused for every page and row
+row_xpath = etree.XPath("//*[@id='price_table']//tr[contains(concat(' ', normalize-space(@class), ' '), ' table-row ')]")
+# The price is in a <b> coloured #84845C for 98 and #000000 for diesel
+price_xpath = etree.XPath(".//b[contains(@style, '84845C') or contains(@style, '000000')]")
+# The station is the first <b> without a style, minus the city in its <small>,
+# e.g. <b>Preem<br/><small>Malmö</small></b> ... <b style="color:#000000;">17.29kr</b>
+station_xpath = etree.XPath("(.//b[not(@style)])[1]//text()[not(ancestor::small)]")
+city_xpath = etree.XPath("string((.//small)[1])")
+
 def get_site(link):
-    headers = {
-    'User-Agent': 'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/63.0.3239.132 Safari/537.36 QIHU 360SE'
-    }
-    f = requests.get(link, headers = headers)
+    # Closing the response hands the connection back to the session pool,
+    # also if parsing fails half way
+    with session.get(link, stream=True, timeout=15) as f:
+        f.raise_for_status()
 
-    # Parse website through lxml as parser
-    soup = BeautifulSoup(f.content,'lxml')
-    return soup
+        # Feed the page to lxml while it is still downloading instead of
+        # waiting for the whole body first. Use the charset from the headers
+        # if there is one, otherwise the site's UTF-8, since lxml would
+        # otherwise guess Latin-1 and mangle å, ä and ö
+        encoding = f.encoding if 'charset' in f.headers.get('Content-Type', '') else 'utf-8'
+        parser = html.HTMLParser(encoding=encoding)
+        for chunk in f.iter_content(8192):
+            parser.feed(chunk)
+        return parser.close()
 
 
 
 
 # Function to extract the correct data froim the website
-# Takes a parameter soup to work with
-def extract_data(soup):
-    location = soup.find(id='price_table').find_all('small')
-    data = soup.find(id='price_table').find_all('tr', {"class":"table-row"})
-
-    # Put into list and make string
-    list = []
-    for i in data:
-        list.append(str(i))
+# Takes a parameter tree (the parsed page) to work with
+def extract_data(tree):
+    data = row_xpath(tree)
 
     #Define lists for later saving
     tankstation = []
     stad = []
     pris = []
     is98 = False
-    for k in range(len(list)):
-        if "84845C" in list[k]:
-            tankstation.append(list[k][(list[k].find("<b>")+3):list[k].find("<small>")])
-            stad.append(list[k][(list[k].find("<small>")+7):list[k].find("</small>")])
-            pris.append(list[k][(list[k].find("#84845C")+10):(list[k].find("</b><br/><small>")-2)])
+    for row in data:
+        price = price_xpath(row)
+        if not price:
+            continue
+        price = price[0]
+        if "84845C" in price.get("style"):
             is98 = True
-        elif "#000000" in list[k]:
-            tankstation.append(list[k][(list[k].find("<b>")+3):list[k].find("<small>")])
-            stad.append(list[k][(list[k].find("<small>")+7):list[k].find("</small>")])
-            pris.append(list[k][(list[k].find("#000000")+10):(list[k].find("</b><br/><small>")-2)])
+        tankstation.append(' '.join(''.join(station_xpath(row)).split()))
+        stad.append(city_xpath(row).strip())
+        # Cut the trailing "kr" from the price
+        pris.append(price.text_content().strip()[:-2].strip())
+
+
+    # Build the dataframe in one go with one column per field
+    resultat = pd.DataFrame({
+        "Tankstation": tankstation,
+        "Stad": stad,
+        "Pris": pris,
+        "Bränsle": ['98' if is98 else 'Diesel'] * len(pris),
+    })
+    return resultat
 
 
-    resultat = pd.DataFrame([tankstation, stad, pris])
-    additional = []
-    if is98:
-        for i in range(len(pris)):
-            additional.append('98')
-    else:
-        for i in range(len(pris)):
-            additional.append('Diesel')
-    # resultat = pd.concat([resultat, pd.DataFrame(additional)], axis=1)
-    row = pd.Series(additional, index = resultat.columns)
-    resultat = resultat.append(row, ignore_index=True)
-    return resultat
+csv_path = r"C:\Users\M\Documents\Programmering\bensinpriser.csv"
 
+# Function to get the date of the last saved row. Only the header and the
+# end of the file are read, so the cost does not grow with the file
+def get_last_date(path):
+    with open(path, 'rb') as f:
+        header = f.readline()
+        f.seek(0, os.SEEK_END)
+        f.seek(max(len(header), f.tell() - 4096))
+        lines = f.read().splitlines()
+    if not lines:
+        return None
+    columns = next(csv.reader([header.decode('utf-8')]))
+    last = next(csv.reader([lines[-1].decode('utf-8')]))
+    return last[columns.index("Datum")]
 
-def save_to_csv(resultat98, resultat_diesel):
 
-    #Create dataframe because that is needed for CSV
-    df = pd.DataFrame(data=resultat98)
-    df = pd.concat([resultat98,resultat_diesel])
+def save_to_csv(resultat, today):
 
-    # Transpose to get other direction
-    df = df.transpose()
+    # Put the fuels next to each other, one station per row, in a single concat
+    df = pd.concat(resultat, axis=1)
 
     # Add Today's date to the data
-    today = date.today()
-    todaylist =[]
-    for i in range(len(df)):
-        todaylist.append(today)   
-    df = pd.concat([df,pd.DataFrame(todaylist)], axis=1)
-
-    # If the file already exists, do not include headers
-    if os.path.isfile(r"C:\Users\M\Documents\Programmering\bensinpriser.csv"):
-        read = pd.read_csv(r"C:\Users\M\Documents\Programmering\bensinpriser.csv")
-        
-        #If the date is the same do not add additional data
-        print_red_on_cyan = lambda x: cprint(x, 'red', 'on_cyan')
-        if read["Datum"].loc[read.index[2]] == today:
-            print('\n')
-            print('================================================')
-            print_red_on_cyan("No additional information added since the date is the same")
-            print('================================================')
-            print('\n')
-        else:
-            df.to_csv(r"C:\Users\M\Documents\Programmering\bensinpriser.csv", mode='a', header=False, index=False)
-        
-            
+    df["Datum"] = today
+
+    # If the file already exists, do not include headers. The column names
+    # come from extract_data, plus Datum
+    if os.path.isfile(csv_path):
+        df.to_csv(csv_path, mode='a', header=False, index=False)
     else:
-        # Add descriptive column names as headers
-        df.columns=["Tankstation","Stad","Pris", "Bränsle", "Tankstation","Stad","Pris", "Bränsle", "Datum"]
-        df.to_csv(r"C:\Users\M\Documents\Programmering\bensinpriser.csv", mode='w', index=False)
+        df.to_csv(csv_path, mode='w', index=False)
     print(df)
     
 
@@ -130,13 +124,30 @@ def save_to_csv(resultat98, resultat_diesel):
 
 # Execution
 
-# Complex but working way of getting 98 data:
-# Every step passes a data over to the next one, therefore the nesting
-resultat98 = extract_data(get_site(url_98))
-
-#Get diesel data:
-resultat_diesel = extract_data(get_site(url_diesel))
-
-
-save_to_csv(resultat98, resultat_diesel)
+# Today's date, taken once for the whole run
+today = date.today()
+
+#If the date is the same do not add additional data, and do not even
+#fetch the sites since nothing would be saved anyway
+if os.path.isfile(csv_path) and get_last_date(csv_path) == today.isoformat():
+    # Only needed here, so not imported at startup
+    from termcolor import cprint
+    print_red_on_cyan = lambda x: cprint(x, 'red', 'on_cyan')
+    print('\n')
+    print('================================================')
+    print_red_on_cyan("No additional information added since the date is the same")
+    print('================================================')
+    print('\n')
+    sys.exit(0)
+
+# Complex but working way of getting 98 and diesel data:
+# Every step passes a data over to the next one, therefore the nesting.
+# Both sites are fetched and parsed at the same time since the work is
+# mostly waiting on the network
+with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+    resultat = list(executor.map(
+        lambda link: extract_data(get_site(link)), urls))
+
+
+save_to_csv(resultat, today)
 